@@ -89,7 +89,7 @@ check_installation_status() {
     local is_installed=0
     
     # Check if Python dependencies are installed
-    if $PYTHON_CMD -c "import requests" 2>/dev/null; then
+    if $PYTHON_CMD -c "import httpx" 2>/dev/null; then
         is_installed=1
     fi
     
@@ -187,7 +187,7 @@ install_python_dependencies() {
     print_success "Python dependencies installed"
     
     # Verify installation
-    if "$venv_dir/bin/python" -c "import requests" 2>/dev/null; then
+    if "$venv_dir/bin/python" -c "import httpx" 2>/dev/null; then
         print_success "Dependencies verified successfully"
     else
         print_error "Failed to verify dependencies"
@@ -3,81 +3,49 @@ Honey Store Data Scraper
 Scrapes store information from Honey's public API endpoints
 """
 
-import requests
-import json
+import httpx
+import orjson
+import zlib
 import time
-from urllib.parse import urlencode
-from typing import Dict, List, Optional
+import random
+import threading
+import itertools
+import functools
+import collections
+from urllib.parse import quote
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional, Set, Tuple
 import csv
-from datetime import datetime
+import io
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 
-class HoneyScraper:
-    """Scraper for Honey store data"""
-    
-    BASE_URL = "https://d.joinhoney.com"
-    
-    def __init__(self, delay: float = 0.5, db_path: str = "honey_stores.db"):
-        """
-        Initialize scraper
-        
-        Args:
-            delay: Delay between requests in seconds to be respectful
-            db_path: Path to SQLite database file
-        """
-        self.delay = delay
-        self.db_path = db_path
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self._init_database()
-    
-    def _init_database(self):
-        """Initialize SQLite database with schema"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create stores table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stores (
-                store_id TEXT PRIMARY KEY,
-                domain TEXT,
-                partial_url TEXT,
-                name TEXT,
-                label TEXT,
-                country TEXT,
-                url TEXT,
-                logo_url TEXT,
-                active INTEGER,
-                supported INTEGER,
-                support_stage TEXT,
-                created INTEGER,
-                updated INTEGER,
-                checked INTEGER,
-                score INTEGER,
-                shoppers_24h INTEGER,
-                shoppers_30d INTEGER,
-                shoppers_change INTEGER,
-                num_savings_24h INTEGER,
-                num_savings_30d INTEGER,
-                avg_savings_24h REAL,
-                avg_savings_30d REAL,
-                metadata TEXT,
-                affiliate_url TEXT,
-                affiliate_restrictions TEXT,
-                ugc_allowed INTEGER,
-                free_shipping_threshold REAL,
-                force_js_redirect INTEGER,
-                launchpad_pathname TEXT,
-                raw_json TEXT
-            )
-        """)
-        
-        # Create coupons table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS coupons (
+# Upper bound on any single rate-limit wait, in seconds
+MAX_RETRY_DELAY = 30
+
+# Generated columns need SQLite 3.31+. With them, each coupon is stored once as
+# raw_json and SQLite derives meta_json/sources_json/tags_json from it;
+# otherwise the three columns are serialized in Python.
+GENERATED_COLUMNS = sqlite3.sqlite_version_info >= (3, 31, 0)
+
+if GENERATED_COLUMNS:
+    COUPON_JSON_COLUMNS_DDL = """
+                raw_json TEXT,
+                meta_json TEXT GENERATED ALWAYS AS (COALESCE(json_extract(raw_json, '$.meta'), json_object())) STORED,
+                sources_json TEXT GENERATED ALWAYS AS (COALESCE(json_extract(raw_json, '$.sources'), json_array())) STORED,
+                tags_json TEXT GENERATED ALWAYS AS (COALESCE(json_extract(raw_json, '$.tags'), json_array())) STORED,"""
+    COUPON_JSON_COLUMNS = ('raw_json',)
+else:
+    COUPON_JSON_COLUMNS_DDL = """
+                meta_json TEXT,
+                sources_json TEXT,
+                tags_json TEXT,"""
+    COUPON_JSON_COLUMNS = ('meta_json', 'sources_json', 'tags_json')
+
+COUPONS_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS {table} (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 store_id TEXT,
                 code TEXT,
@@ -92,182 +60,834 @@ class HoneyScraper:
                 applied_acc_count INTEGER,
                 applied_acc_last_ts INTEGER,
                 applied_acc_last_discount REAL,
-                url TEXT,
-                meta_json TEXT,
-                sources_json TEXT,
-                tags_json TEXT,
+                url TEXT,{json_columns}
                 FOREIGN KEY (store_id) REFERENCES stores(store_id)
             )
-        """)
-        
-        # Create partial_urls table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS partial_urls (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                store_id TEXT,
-                domain TEXT,
-                partial_url TEXT,
-                FOREIGN KEY (store_id) REFERENCES stores(store_id)
-            )
-        """)
-        
-        # Create scraped_domains tracking table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS scraped_domains (
-                domain TEXT PRIMARY KEY,
-                scraped_at INTEGER,
-                store_count INTEGER
+"""
+COUPON_BASE_COLUMNS = (
+    'store_id', 'code', 'deal_id', 'description', 'created', 'expires',
+    'exclusive', 'hidden', 'restrictions', 'rank', 'applied_acc_count',
+    'applied_acc_last_ts', 'applied_acc_last_discount', 'url'
+)
+COUPON_COLUMNS = COUPON_BASE_COLUMNS + COUPON_JSON_COLUMNS
+PARTIAL_URL_COLUMNS = ('store_id', 'domain', 'partial_url')
+
+# (column, API key) pairs for the stores table, in INSERT order
+STORE_FIELDS = (
+    ('name', 'name'), ('label', 'label'), ('country', 'country'), ('url', 'url'),
+    ('logo_url', 'logoUrl'), ('support_stage', 'supportStage'),
+    ('created', 'created'), ('updated', 'updated'), ('checked', 'checked'), ('score', 'score'),
+    ('shoppers_24h', 'shoppers24h'), ('shoppers_30d', 'shoppers30d'), ('shoppers_change', 'shoppersChange'),
+    ('num_savings_24h', 'numSavings24h'), ('num_savings_30d', 'numSavings30d'),
+    ('avg_savings_24h', 'avgSavings24h'), ('avg_savings_30d', 'avgSavings30d'),
+    ('metadata', 'metadata'), ('affiliate_url', 'affiliateURL'),
+    ('affiliate_restrictions', 'affiliateRestrictions'),
+    ('free_shipping_threshold', 'freeShippingThreshold'), ('launchpad_pathname', 'launchpadPathname'),
+)
+# Boolean fields, stored as 0/1
+STORE_BOOL_FIELDS = (
+    ('active', 'active'), ('supported', 'supported'),
+    ('ugc_allowed', 'ugcAllowed'), ('force_js_redirect', 'forceJsRedirect'),
+)
+STORE_KEYS = tuple(key for _, key in STORE_FIELDS)
+STORE_BOOL_KEYS = tuple(key for _, key in STORE_BOOL_FIELDS)
+STORE_COLUMNS = (
+    ('store_id', 'domain', 'partial_url')
+    + tuple(col for col, _ in STORE_FIELDS)
+    + tuple(col for col, _ in STORE_BOOL_FIELDS)
+    + ('raw_json', 'etag', 'last_modified', 'coupon_count')
+)
+
+# Native upsert (SQLite 3.24+) updates the row in place; INSERT OR REPLACE
+# deletes and re-inserts it, touching every index twice
+if sqlite3.sqlite_version_info >= (3, 24, 0):
+    INSERT_STORE_SQL = f"""
+        INSERT INTO stores ({', '.join(STORE_COLUMNS)})
+        VALUES ({', '.join(['?'] * len(STORE_COLUMNS))})
+        ON CONFLICT(store_id) DO UPDATE SET
+            {', '.join(f'{col} = excluded.{col}' for col in STORE_COLUMNS[1:])}
+    """
+else:
+    INSERT_STORE_SQL = f"""
+        INSERT OR REPLACE INTO stores ({', '.join(STORE_COLUMNS)})
+        VALUES ({', '.join(['?'] * len(STORE_COLUMNS))})
+    """
+DELETE_COUPONS_SQL = "DELETE FROM coupons WHERE store_id = ?"
+DELETE_PARTIAL_URLS_SQL = "DELETE FROM partial_urls WHERE store_id = ?"
+INDICES = (
+    ('idx_stores_domain', "CREATE INDEX IF NOT EXISTS idx_stores_domain ON stores(domain)"),
+    ('idx_stores_country', "CREATE INDEX IF NOT EXISTS idx_stores_country ON stores(country)"),
+    ('idx_stores_active', "CREATE INDEX IF NOT EXISTS idx_stores_active ON stores(active)"),
+    ('idx_stores_active_country', "CREATE INDEX IF NOT EXISTS idx_stores_active_country ON stores(active, country)"),
+    ('idx_stores_updated', "CREATE INDEX IF NOT EXISTS idx_stores_updated ON stores(updated, store_id)"),
+    ('idx_coupons_store', "CREATE INDEX IF NOT EXISTS idx_coupons_store ON coupons(store_id)"),
+    ('idx_partial_urls_store', "CREATE INDEX IF NOT EXISTS idx_partial_urls_store ON partial_urls(store_id)"),
+    ('idx_usage_reports_coupon', "CREATE INDEX IF NOT EXISTS idx_usage_reports_coupon ON coupon_usage_reports(coupon_id)"),
+    ('idx_usage_reports_store', "CREATE INDEX IF NOT EXISTS idx_usage_reports_store ON coupon_usage_reports(store_id)"),
+    ('idx_usage_reports_code', "CREATE INDEX IF NOT EXISTS idx_usage_reports_code ON coupon_usage_reports(code)"),
+)
+# Indices maintained on every store write but never read while scraping.
+# The coupons/partial_urls store_id indices stay: the per-store DELETEs need them.
+BULK_DROPPABLE_INDICES = (
+    'idx_stores_domain', 'idx_stores_country', 'idx_stores_active', 'idx_stores_active_country',
+    'idx_stores_updated'
+)
+# (ETag, Last-Modified) of a store detail response
+Validators = Tuple[Optional[str], Optional[str]]
+NO_VALIDATORS: Validators = (None, None)
+
+MARK_DOMAIN_SQL = """
+    INSERT OR REPLACE INTO scraped_domains (domain, scraped_at, store_count)
+    VALUES (?, ?, ?)
+"""
+
+
+@functools.lru_cache(maxsize=64)
+def _bulk_insert_sql(table: str, cols: Tuple[str, ...], n_rows: int) -> str:
+    """Build (once per shape) a multi-row INSERT so SQLite's statement cache can reuse it"""
+    row_placeholder = "(" + ",".join(["?"] * len(cols)) + ")"
+    placeholders = ",".join([row_placeholder] * n_rows)
+    return f"INSERT INTO {table} ({', '.join(cols)}) VALUES {placeholders}"
+
+
+def raw_json_text(value) -> str:
+    """Return stores.raw_json as JSON text (zlib-compressed BLOB, or TEXT from older rows)"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+EXPORT_CSV_FIELDS = (
+    'domain', 'store_id', 'partial_url', 'name', 'country', 'url',
+    'active', 'supported', 'shoppers_30d', 'num_coupons',
+    'logo_url', 'created', 'updated'
+)
+
+
+def iter_json_export(conn: sqlite3.Connection, limit: Optional[int] = None,
+                     batch_size: int = 1000) -> Generator[bytes, None, int]:
+    """
+    Yield the JSON export of the stores table in chunks of batch_size stores
+    
+    Memory stays flat however large the table is. The generator's return
+    value (StopIteration.value) is the number of stores exported.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    query = "SELECT * FROM stores"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    cursor.execute(query)
+    
+    count = 0
+    yield b'['
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        parts = []
+        for row in rows:
+            store_data = dict(row)
+            # Parse raw JSON back to object
+            if store_data.get('raw_json'):
+                store_data['raw_json'] = raw_json_text(store_data['raw_json'])
+                store_data['details'] = orjson.loads(store_data['raw_json'])
+            parts.append(b'\n' if count == 0 else b',\n')
+            parts.append(orjson.dumps(store_data, option=orjson.OPT_INDENT_2))
+            count += 1
+        yield b''.join(parts)
+    yield b'\n]\n' if count else b']\n'
+    return count
+
+
+def iter_csv_export(conn: sqlite3.Connection, limit: Optional[int] = None,
+                    batch_size: int = 1000) -> Generator[str, None, int]:
+    """
+    Yield the CSV export of the stores table in chunks of batch_size rows
+    
+    The generator's return value (StopIteration.value) is the number of
+    stores exported.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    query = """
+        SELECT 
+            domain, store_id, partial_url, name, country, url,
+            active, supported, shoppers_30d, logo_url, created, updated,
+            coupon_count as num_coupons
+        FROM stores
+        ORDER BY store_id
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    cursor.execute(query)
+    
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_CSV_FIELDS)
+    writer.writeheader()
+    count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        writer.writerows(map(dict, rows))
+        count += len(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if not count:
+        yield buf.getvalue()
+    return count
+
+
+def _write_chunks(f, chunks: Generator) -> int:
+    """Write every chunk from an export generator to f and return its result"""
+    while True:
+        try:
+            f.write(next(chunks))
+        except StopIteration as done:
+            return done.value
+
+
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+    """Add a column to an existing table (SQLite has no ADD COLUMN IF NOT EXISTS), returning True if added"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+def _migrate_coupons_raw_json(conn: sqlite3.Connection):
+    """Rebuild an old coupons table so its JSON columns are generated from raw_json"""
+    if not GENERATED_COLUMNS:
+        return
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(coupons)")}
+    if 'raw_json' in columns:
+        return
+    
+    # Generated columns can't be added with ALTER TABLE, so copy into a new table
+    print("Migrating coupons table to generated JSON columns...")
+    base_columns = ', '.join(COUPON_BASE_COLUMNS)
+    conn.executescript(f"""
+        BEGIN;
+        DROP TABLE IF EXISTS coupons_new;
+        {COUPONS_TABLE_SQL.format(table='coupons_new', json_columns=COUPON_JSON_COLUMNS_DDL)};
+        INSERT INTO coupons_new (id, {base_columns}, raw_json)
+            SELECT id, {base_columns},
+                   json_object('meta', json(meta_json), 'sources', json(sources_json), 'tags', json(tags_json))
+            FROM coupons;
+        DROP TABLE coupons;
+        ALTER TABLE coupons_new RENAME TO coupons;
+        COMMIT;
+    """)
+
+
+def create_indices(conn: sqlite3.Connection):
+    """Create the secondary indices in INDICES"""
+    for _, ddl in INDICES:
+        conn.execute(ddl)
+
+
+def init_schema(conn: sqlite3.Connection):
+    """
+    Create any missing tables and indices and migrate older databases
+    
+    conn must be in autocommit mode (isolation_level=None).
+    """
+    cursor = conn.cursor()
+    
+    # Create stores table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stores (
+            store_id TEXT PRIMARY KEY,
+            domain TEXT,
+            partial_url TEXT,
+            name TEXT,
+            label TEXT,
+            country TEXT,
+            url TEXT,
+            logo_url TEXT,
+            active INTEGER,
+            supported INTEGER,
+            support_stage TEXT,
+            created INTEGER,
+            updated INTEGER,
+            checked INTEGER,
+            score INTEGER,
+            shoppers_24h INTEGER,
+            shoppers_30d INTEGER,
+            shoppers_change INTEGER,
+            num_savings_24h INTEGER,
+            num_savings_30d INTEGER,
+            avg_savings_24h REAL,
+            avg_savings_30d REAL,
+            metadata TEXT,
+            affiliate_url TEXT,
+            affiliate_restrictions TEXT,
+            ugc_allowed INTEGER,
+            free_shipping_threshold REAL,
+            force_js_redirect INTEGER,
+            launchpad_pathname TEXT,
+            raw_json BLOB,
+            etag TEXT,
+            last_modified TEXT,
+            coupon_count INTEGER DEFAULT 0
+        )
+    """)
+    
+    # Create coupons table
+    cursor.execute(COUPONS_TABLE_SQL.format(table='coupons', json_columns=COUPON_JSON_COLUMNS_DDL))
+    
+    # Create partial_urls table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS partial_urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id TEXT,
+            domain TEXT,
+            partial_url TEXT,
+            FOREIGN KEY (store_id) REFERENCES stores(store_id)
+        )
+    """)
+    
+    # Create scraped_domains tracking table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scraped_domains (
+            domain TEXT PRIMARY KEY,
+            scraped_at INTEGER,
+            store_count INTEGER
+        )
+    """)
+    
+    # Create HTTP cache table (conditional GET validators + last body)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS http_cache (
+            key TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB,
+            fetched_at INTEGER
+        )
+    """)
+    
+    # Create coupon usage reports table (user-generated data)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS coupon_usage_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            coupon_id INTEGER NOT NULL,
+            store_id TEXT NOT NULL,
+            code TEXT NOT NULL,
+            worked INTEGER NOT NULL,
+            amount_saved REAL,
+            amount_spent REAL,
+            notes TEXT,
+            reported_at INTEGER NOT NULL,
+            FOREIGN KEY (coupon_id) REFERENCES coupons(id),
+            FOREIGN KEY (store_id) REFERENCES stores(store_id)
+        )
+    """)
+    
+    # Migrate databases created before these columns existed
+    _add_column_if_missing(conn, 'stores', 'etag', 'TEXT')
+    _add_column_if_missing(conn, 'stores', 'last_modified', 'TEXT')
+    if _add_column_if_missing(conn, 'stores', 'coupon_count', 'INTEGER DEFAULT 0'):
+        # Backfill stores saved before the column existed
+        conn.execute("""
+            UPDATE stores SET coupon_count = (
+                SELECT COUNT(*) FROM coupons WHERE coupons.store_id = stores.store_id
             )
         """)
+    _migrate_coupons_raw_json(conn)
+    
+    create_indices(conn)
+
+
+def _bounded_map(executor: ThreadPoolExecutor, fn: Callable, items: Iterable, window: int,
+                 before_wait: Optional[Callable[[], None]] = None) -> Iterator:
+    """
+    Like executor.map, but keeps at most `window` calls in flight instead of submitting all items
+    
+    before_wait, if given, is called whenever the next result isn't ready
+    yet, just before blocking on it.
+    """
+    pending = collections.deque()
+    
+    def next_result():
+        future = pending.popleft()
+        if before_wait is not None and not future.done():
+            before_wait()
+        return future.result()
+    
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield next_result()
+    while pending:
+        yield next_result()
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows bursts up to capacity, refills at rate tokens/sec"""
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping only if none is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """
+    Thread-safe adaptive concurrency limit, TCP congestion control style
+    
+    Tracks the outcome of recent requests. When the error rate over the
+    window passes overload_rate the limit is halved and delay_factor doubled;
+    after a full window of consecutive successes the limit grows by one and
+    delay_factor shrinks by 5%.
+    """
+    
+    def __init__(self, limit: int, max_limit: int, window: int = 100,
+                 overload_rate: float = 0.1, max_delay_factor: float = 8.0):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.window = window
+        self.overload_rate = overload_rate
+        self.max_delay_factor = max_delay_factor
+        self.delay_factor = 1.0
+        self._results = collections.deque(maxlen=window)
+        self._successes = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def backed_off(self) -> bool:
+        """True once the limiter can't slow down any further"""
+        return self.limit == 1 and self.delay_factor >= self.max_delay_factor
+    
+    def acquire(self):
+        """Wait for a free request slot"""
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+    
+    def release(self, ok: Optional[bool]):
+        """Free a slot and record the outcome (None: doesn't say anything about load)"""
+        with self._cond:
+            self._in_flight -= 1
+            if ok:
+                self._results.append(True)
+                self._successes += 1
+                if self._successes >= self.window:
+                    self._successes = 0
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.delay_factor = max(1.0, self.delay_factor * 0.95)
+            elif ok is not None:
+                self._results.append(False)
+                self._successes = 0
+                # Need a few samples before an error rate means anything
+                errors = self._results.count(False)
+                if len(self._results) >= 10 and errors / len(self._results) > self.overload_rate:
+                    self.limit = max(1, self.limit // 2)
+                    self.delay_factor = min(self.max_delay_factor, self.delay_factor * 2)
+                    # Judge the new settings on fresh results
+                    self._results.clear()
+            self._cond.notify_all()
+
+
+class HoneyScraper:
+    """Scraper for Honey store data"""
+    
+    BASE_URL = "https://d.joinhoney.com"
+    # Pre-encoded query strings; only the variable values are filled in per request
+    _IDS_URL_TMPL = (
+        BASE_URL + "/v3?operationName=ext_getStorePartialsByDomain"
+        "&variables=%7B%22domain%22%3A%22{}%22%7D"
+    )
+    _DETAILS_URL_TMPL = (
+        BASE_URL + "/v3?operationName=ext_getStoreById"
+        "&variables=%7B%22storeId%22%3A%22{}%22%2C%22maxUGC%22%3A{}%2C%22successCount%22%3A{}%7D"
+        "&operationVersion=18"
+    )
+    # Supported-domain list shared by every instance in the process (the
+    # dashboard creates a scraper per run); cleared by clear_domains_cache
+    _domains_cache: Optional[List[str]] = None
+    _domains_lock = threading.Lock()
+    
+    def __init__(self, delay: float = 0.5, db_path: str = "honey_stores.db", workers: int = 16):
+        """
+        Initialize scraper
         
-        # Create coupon usage reports table (user-generated data)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS coupon_usage_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                coupon_id INTEGER NOT NULL,
-                store_id TEXT NOT NULL,
-                code TEXT NOT NULL,
-                worked INTEGER NOT NULL,
-                amount_saved REAL,
-                amount_spent REAL,
-                notes TEXT,
-                reported_at INTEGER NOT NULL,
-                FOREIGN KEY (coupon_id) REFERENCES coupons(id),
-                FOREIGN KEY (store_id) REFERENCES stores(store_id)
-            )
+        Args:
+            delay: Delay between requests in seconds to be respectful
+            db_path: Path to SQLite database file
+            workers: Number of concurrent store detail requests
+        """
+        self.delay = delay
+        self.db_path = db_path
+        self.workers = workers
+        # Writes are grouped into transactions of whole domains, so a domain's
+        # stores and its scraped_domains row commit together. A batch is
+        # committed once it is full, and before the scrape loop waits on the
+        # network, so the write lock is never held across HTTP requests.
+        self._batch_size = 200
+        self._pending_writes = 0
+        self._bucket = TokenBucket(rate=1.0 / delay if delay > 0 else 1.0, capacity=8)
+        # Backs off concurrency and delay when the API starts failing
+        self._limiter = AIMDLimiter(limit=workers, max_limit=workers)
+        # Loaded by _load_scraped_domains; None means "not loaded, ask SQLite"
+        self._scraped_domains: Optional[Set[str]] = None
+        self._existing_store_ids: Set[str] = set()
+        # Per-thread read connections for the pool workers; self.conn belongs
+        # to the writer thread (closed by close)
+        self._thread_local = threading.local()
+        self._read_connections: List[sqlite3.Connection] = []
+        # HTTP/2 multiplexes the worker threads' requests over a few TLS
+        # connections, kept alive for the whole run. The pool is sized to the
+        # worker count, and the transport retries failed connection attempts
+        # itself (status-level retries stay in _request_with_retry).
+        self.session = httpx.Client(
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_keepalive_connections=workers, max_connections=workers),
+            ),
+            timeout=30.0,
+            # requests followed redirects by default; httpx doesn't
+            follow_redirects=True,
+            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        )
+        self._init_database()
+    
+    def _init_database(self):
+        """Initialize SQLite database with schema and open the shared connection"""
+        # One connection for the lifetime of the scraper; transactions are
+        # managed explicitly (isolation_level=None) so WAL + NORMAL sync
+        # avoids an fsync per store.
+        self.conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False, cached_statements=128
+        )
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-200000;
+            PRAGMA mmap_size=268435456;
         """)
+        init_schema(self.conn)
         
-        # Create indices for better query performance
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_domain ON stores(domain)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_country ON stores(country)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_active ON stores(active)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupons_store ON coupons(store_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_partial_urls_store ON partial_urls(store_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_reports_coupon ON coupon_usage_reports(coupon_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_reports_store ON coupon_usage_reports(store_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_reports_code ON coupon_usage_reports(code)")
-        
-        conn.commit()
-        conn.close()
+        # Long-lived cursor for the write path
+        self._cursor = self.conn.cursor()
         print(f"Database initialized: {self.db_path}")
     
+    def _create_indices(self):
+        """Create secondary indices for better query performance"""
+        create_indices(self.conn)
+    
+    def _drop_indices(self):
+        """Drop the indices the scrape path doesn't read (rebuilt by _create_indices)"""
+        for name in BULK_DROPPABLE_INDICES:
+            self.conn.execute(f"DROP INDEX IF EXISTS {name}")
+    
     def _store_exists(self, store_id: str) -> bool:
         """Check if store already exists in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         cursor.execute("SELECT 1 FROM stores WHERE store_id = ?", (store_id,))
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        return cursor.fetchone() is not None
+    
+    def _existing_store_ids_in(self, store_ids: List[str], chunk: int = 500,
+                               conn: Optional[sqlite3.Connection] = None) -> Set[str]:
+        """Return which of store_ids are already saved, using one IN query per chunk"""
+        conn = conn or self.conn
+        existing = set()
+        for start in range(0, len(store_ids), chunk):
+            batch = store_ids[start:start + chunk]
+            placeholders = ','.join('?' * len(batch))
+            existing.update(row[0] for row in conn.execute(
+                f"SELECT store_id FROM stores WHERE store_id IN ({placeholders})", batch
+            ))
+        return existing
+    
+    def _read_connection(self) -> sqlite3.Connection:
+        """This thread's own read connection (self.conn belongs to the writer)"""
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._thread_local.conn = conn
+            self._read_connections.append(conn)
+        return conn
+    
+    def _load_scraped_domains(self) -> Set[str]:
+        """Load all scraped domains into memory so skip checks don't hit SQLite"""
+        self._scraped_domains = {row[0] for row in self.conn.execute("SELECT domain FROM scraped_domains")}
+        return self._scraped_domains
     
     def _domain_scraped(self, domain: str) -> bool:
         """Check if domain has been scraped"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if self._scraped_domains is not None:
+            return domain in self._scraped_domains
+        cursor = self.conn.cursor()
         cursor.execute("SELECT 1 FROM scraped_domains WHERE domain = ?", (domain,))
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        return cursor.fetchone() is not None
     
-    def _save_store_to_db(self, domain: str, store_id: str, partial_url: str, details: Dict):
-        """Save store data to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _bulk_insert(self, cursor: sqlite3.Cursor, table: str, cols: Tuple[str, ...],
+                     rows: List[Tuple], chunk: int = 400):
+        """
+        Insert rows using multi-row VALUES statements
         
-        try:
-            # Insert store
-            cursor.execute("""
-                INSERT OR REPLACE INTO stores (
-                    store_id, domain, partial_url, name, label, country, url, logo_url,
-                    active, supported, support_stage, created, updated, checked, score,
-                    shoppers_24h, shoppers_30d, shoppers_change, num_savings_24h, num_savings_30d,
-                    avg_savings_24h, avg_savings_30d, metadata, affiliate_url, affiliate_restrictions,
-                    ugc_allowed, free_shipping_threshold, force_js_redirect, launchpad_pathname, raw_json
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                store_id, domain, partial_url,
-                details.get('name'), details.get('label'), details.get('country'),
-                details.get('url'), details.get('logoUrl'),
-                1 if details.get('active') else 0,
-                1 if details.get('supported') else 0,
-                details.get('supportStage'),
-                details.get('created'), details.get('updated'), details.get('checked'),
-                details.get('score'),
-                details.get('shoppers24h'), details.get('shoppers30d'), details.get('shoppersChange'),
-                details.get('numSavings24h'), details.get('numSavings30d'),
-                details.get('avgSavings24h'), details.get('avgSavings30d'),
-                details.get('metadata'),
-                details.get('affiliateURL'), details.get('affiliateRestrictions'),
-                1 if details.get('ugcAllowed') else 0,
-                details.get('freeShippingThreshold'),
-                1 if details.get('forceJsRedirect') else 0,
-                details.get('launchpadPathname'),
-                json.dumps(details)
-            ))
-            
-            # Insert coupons
-            cursor.execute("DELETE FROM coupons WHERE store_id = ?", (store_id,))
-            for coupon in details.get('publicCoupons', []):
-                cursor.execute("""
-                    INSERT INTO coupons (
-                        store_id, code, deal_id, description, created, expires,
-                        exclusive, hidden, restrictions, rank, applied_acc_count,
-                        applied_acc_last_ts, applied_acc_last_discount, url,
-                        meta_json, sources_json, tags_json
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    store_id, coupon.get('code'), coupon.get('dealId'),
-                    coupon.get('description'), coupon.get('created'), coupon.get('expires'),
-                    1 if coupon.get('exclusive') else 0,
-                    1 if coupon.get('hidden') else 0,
-                    coupon.get('restrictions'), coupon.get('rank'),
-                    coupon.get('applied_acc_count'), coupon.get('applied_acc_last_ts'),
-                    coupon.get('applied_acc_last_discount'), coupon.get('url'),
-                    json.dumps(coupon.get('meta', {})),
-                    json.dumps(coupon.get('sources', [])),
-                    json.dumps(coupon.get('tags', []))
-                ))
-            
-            # Insert partial URLs
-            cursor.execute("DELETE FROM partial_urls WHERE store_id = ?", (store_id,))
-            for pu in details.get('partialUrls', []):
-                cursor.execute("""
-                    INSERT INTO partial_urls (store_id, domain, partial_url)
-                    VALUES (?, ?, ?)
-                """, (store_id, pu.get('domain'), pu.get('partialURL')))
+        Args:
+            cursor: Cursor to execute on (caller owns the transaction)
+            table: Target table name
+            cols: Column names matching the order of values in each row
+            rows: Row value tuples
+            chunk: Maximum rows per statement (capped by SQLite's 999 parameter limit)
+        """
+        max_rows = max(1, min(chunk, 999 // len(cols)))
+        for start in range(0, len(rows), max_rows):
+            batch = rows[start:start + max_rows]
+            cursor.execute(
+                _bulk_insert_sql(table, cols, len(batch)),
+                tuple(itertools.chain.from_iterable(batch))
+            )
+    
+    @staticmethod
+    def _coupon_json_values(coupon: Dict) -> Tuple[str, ...]:
+        """Values for COUPON_JSON_COLUMNS"""
+        if GENERATED_COLUMNS:
+            return (orjson.dumps(coupon).decode(),)
+        return (
+            orjson.dumps(coupon.get('meta', {})).decode(),
+            orjson.dumps(coupon.get('sources', [])).decode(),
+            orjson.dumps(coupon.get('tags', [])).decode()
+        )
+    
+    def _build_store_rows(self, domain: str, store_id: str, partial_url: str, details: Dict,
+                          validators: Validators) -> Tuple[Tuple, List[Tuple], List[Tuple]]:
+        """Build the stores, coupons and partial_urls rows for one store"""
+        coupon_rows = [
+            (
+                store_id, coupon.get('code'), coupon.get('dealId'),
+                coupon.get('description'), coupon.get('created'), coupon.get('expires'),
+                1 if coupon.get('exclusive') else 0,
+                1 if coupon.get('hidden') else 0,
+                coupon.get('restrictions'), coupon.get('rank'),
+                coupon.get('applied_acc_count'), coupon.get('applied_acc_last_ts'),
+                coupon.get('applied_acc_last_discount'), coupon.get('url'),
+                *self._coupon_json_values(coupon)
+            )
+            for coupon in details.get('publicCoupons', [])
+        ]
+        store_row = (
+            store_id, domain, partial_url,
+            *map(details.get, STORE_KEYS),
+            *[1 if details.get(key) else 0 for key in STORE_BOOL_KEYS],
+            zlib.compress(orjson.dumps(details), 1),
+            *validators,
+            len(coupon_rows)
+        )
+        partial_url_rows = [
+            (store_id, pu.get('domain'), pu.get('partialURL'))
+            for pu in details.get('partialUrls', [])
+        ]
+        return store_row, coupon_rows, partial_url_rows
+    
+    def _write_store_rows(self, cursor: sqlite3.Cursor, rows: List[Tuple[Tuple, List[Tuple], List[Tuple]]]):
+        """Write prebuilt store rows, replacing each store's coupons and partial URLs"""
+        store_ids = [(store_row[0],) for store_row, _, _ in rows]
+        
+        # Insert stores
+        cursor.executemany(INSERT_STORE_SQL, [store_row for store_row, _, _ in rows])
+        
+        # Insert coupons
+        cursor.executemany(DELETE_COUPONS_SQL, store_ids)
+        self._bulk_insert(cursor, "coupons", COUPON_COLUMNS,
+                          [row for _, coupon_rows, _ in rows for row in coupon_rows])
+        
+        # Insert partial URLs
+        cursor.executemany(DELETE_PARTIAL_URLS_SQL, store_ids)
+        self._bulk_insert(cursor, "partial_urls", PARTIAL_URL_COLUMNS,
+                          [row for _, _, partial_url_rows in rows for row in partial_url_rows])
+    
+    def _save_stores_to_db(self, domain: str, stores: List[Tuple[str, str, Dict, Validators]]) -> List[str]:
+        """
+        Save a domain's stores with one set of batched statements
+        
+        Args:
+            domain: Domain the stores were found under
+            stores: (store_id, partial_url, details, validators) tuples
             
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f"Error saving store {store_id} to database: {e}")
-        finally:
-            conn.close()
+        Returns:
+            IDs of the stores that were saved
+        """
+        # Last copy wins if the domain lists a store twice
+        rows = {}
+        for store_id, partial_url, details, validators in stores:
+            try:
+                rows[store_id] = self._build_store_rows(domain, store_id, partial_url, details, validators)
+            except Exception as e:
+                print(f"Error saving store {store_id} to database: {e}")
+        if not rows:
+            return []
+        
+        cursor = self._cursor
+        self._begin_batch()
+        # Savepoint so a failure only rolls back these stores, not the batch
+        cursor.execute("SAVEPOINT store_write")
+        try:
+            self._write_store_rows(cursor, list(rows.values()))
+            cursor.execute("RELEASE store_write")
+            saved = list(rows)
+        except Exception:
+            cursor.execute("ROLLBACK TO store_write")
+            cursor.execute("RELEASE store_write")
+            # Retry one store at a time so a single bad store doesn't sink the rest
+            saved = []
+            for store_id, row in rows.items():
+                cursor.execute("SAVEPOINT store_write")
+                try:
+                    self._write_store_rows(cursor, [row])
+                    cursor.execute("RELEASE store_write")
+                    saved.append(store_id)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO store_write")
+                    cursor.execute("RELEASE store_write")
+                    print(f"Error saving store {store_id} to database: {e}")
+        
+        # Committed with the domain in _mark_domain_scraped
+        self._pending_writes += len(saved)
+        return saved
     
     def _mark_domain_scraped(self, domain: str, store_count: int):
-        """Mark domain as scraped"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO scraped_domains (domain, scraped_at, store_count)
-            VALUES (?, ?, ?)
-        """, (domain, int(time.time() * 1000), store_count))
-        conn.commit()
-        conn.close()
+        """Mark domain as scraped, committing its stores with it if the batch is full"""
+        self._begin_batch()
+        self._cursor.execute(MARK_DOMAIN_SQL, (domain, int(time.time() * 1000), store_count))
+        if self._scraped_domains is not None:
+            self._scraped_domains.add(domain)
+        self._pending_writes += 1
+        self._commit_if_due()
+    
+    def _begin_batch(self):
+        """Open the batch transaction if one isn't already open"""
+        if not self.conn.in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE")
+    
+    def _commit_if_due(self):
+        """Commit at a domain boundary once the batch is full"""
+        if self._pending_writes >= self._batch_size:
+            self.flush()
+    
+    def flush(self):
+        """Commit any pending batched writes"""
+        if self.conn is not None and self.conn.in_transaction:
+            self._cursor.execute("COMMIT")
+        self._pending_writes = 0
+    
+    def _throttle(self):
+        """Block until the rate limiter allows another request"""
+        if self.delay <= 0:
+            return
+        # Follow live delay changes (the dashboard adjusts it while running),
+        # stretched by the adaptive limiter while the API is struggling
+        self._bucket.rate = 1.0 / (self.delay * self._limiter.delay_factor)
+        self._bucket.acquire()
+    
+    def _backoff(self, retry_delay: float):
+        """Sleep before a retry, with jitter so workers don't retry in lockstep"""
+        time.sleep(retry_delay + random.uniform(0, 0.5 * retry_delay))
+    
+    def _sleep_for_retry(self, response: httpx.Response, attempt: int):
+        """Wait out a 429, honoring the server's Retry-After header when present"""
+        retry_after = response.headers.get('Retry-After')
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # HTTP-date form
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        if delay is None:
+            delay = self.delay * 2 ** (attempt + 1)
+        delay = max(0.0, delay) + random.uniform(0, 0.5)
+        time.sleep(min(delay, MAX_RETRY_DELAY))
+    
+    @staticmethod
+    def _conditional_headers(etag: Optional[str], last_modified: Optional[str]) -> Dict[str, str]:
+        """Build If-None-Match / If-Modified-Since headers from stored validators"""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+    
+    @classmethod
+    def clear_domains_cache(cls):
+        """Forget the cached domain list so the next get_supported_domains call refetches it"""
+        with cls._domains_lock:
+            HoneyScraper._domains_cache = None
     
     def get_supported_domains(self) -> List[str]:
         """
-        Fetch all supported domains from Honey
+        Fetch all supported domains from Honey (cached for the life of the process)
         
         Returns:
             List of domain strings
         """
+        with self._domains_lock:
+            if HoneyScraper._domains_cache is None:
+                domains = self._fetch_supported_domains()
+                # Don't cache a failed fetch
+                if domains:
+                    HoneyScraper._domains_cache = domains
+                return list(domains)
+            domains = HoneyScraper._domains_cache
+        print(f"Using cached domain list ({len(domains)} domains)")
+        return list(domains)
+    
+    def _fetch_supported_domains(self) -> List[str]:
+        """Download the supported domain list, revalidating the copy in http_cache"""
         url = f"{self.BASE_URL}/v2/stores/partials/supported-domains"
         print(f"Fetching supported domains from {url}...")
         
+        cached = self.conn.execute(
+            "SELECT etag, last_modified, body FROM http_cache WHERE key = ?", ('supported-domains',)
+        ).fetchone()
+        
         try:
-            response = self.session.get(url, timeout=30)
+            headers = self._conditional_headers(cached[0], cached[1]) if cached else {}
+            response = self.session.get(url, timeout=30, headers=headers)
+            if response.status_code == 304 and cached:
+                domains = orjson.loads(zlib.decompress(cached[2]))
+                print(f"Domain list unchanged, using cached copy ({len(domains)} domains)")
+                return domains
             response.raise_for_status()
-            domains = response.json()
+            domains = orjson.loads(response.content)
+            self.conn.execute("""
+                INSERT OR REPLACE INTO http_cache (key, etag, last_modified, body, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (
+                'supported-domains', response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                zlib.compress(response.content, 1), int(time.time() * 1000)
+            ))
             print(f"Found {len(domains)} supported domains")
             return domains
         except Exception as e:
@@ -284,54 +904,22 @@ class HoneyScraper:
         Returns:
             List of dicts with storeId and partialURL
         """
-        variables = json.dumps({"domain": domain})
-        params = {
-            "operationName": "ext_getStorePartialsByDomain",
-            "variables": variables
-        }
-        url = f"{self.BASE_URL}/v3?{urlencode(params)}"
-        
-        max_retries = 3
-        retry_delay = self.delay
+        url = self._IDS_URL_TMPL.format(quote(domain, safe=''))
         
-        for attempt in range(max_retries):
-            try:
-                time.sleep(retry_delay)
-                response = self.session.get(url, timeout=30)
-                
-                # Check for rate limiting
-                if response.status_code == 429:
-                    retry_delay *= 2  # Exponential backoff
-                    print(f"  ⚠️ Rate limited. Waiting {retry_delay}s before retry {attempt + 1}/{max_retries}...")
-                    time.sleep(retry_delay)
-                    continue
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                if "data" in data and "getPartialURLsByDomain" in data["data"]:
-                    return data["data"]["getPartialURLsByDomain"]
-                return []
-                
-            except requests.exceptions.Timeout:
-                print(f"  ⚠️ Timeout for {domain}. Retry {attempt + 1}/{max_retries}...")
-                retry_delay *= 1.5
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-            except requests.exceptions.RequestException as e:
-                print(f"  ⚠️ Request error for {domain}: {e}. Retry {attempt + 1}/{max_retries}...")
-                retry_delay *= 1.5
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-            except Exception as e:
-                print(f"Error fetching store IDs for {domain}: {e}")
-                break
+        response = self._request_with_retry(url, domain, indent="  ")
+        if response is None:
+            return []
         
+        try:
+            data = orjson.loads(response.content)
+            if "data" in data and "getPartialURLsByDomain" in data["data"]:
+                return data["data"]["getPartialURLsByDomain"]
+        except Exception as e:
+            print(f"Error fetching store IDs for {domain}: {e}")
         return []
     
-    def get_store_details(self, store_id: str, max_ugc: int = 3, success_count: int = 1) -> Optional[Dict]:
+    def get_store_details(self, store_id: str, max_ugc: int = 3,
+                          success_count: int = 1) -> Tuple[Optional[Dict], Validators]:
         """
         Get detailed store information by store ID
         
@@ -341,67 +929,118 @@ class HoneyScraper:
             success_count: Success count parameter
             
         Returns:
-            Store details dict or None
+            Tuple of (store details dict or None, (ETag, Last-Modified) to save with it)
         """
-        variables = json.dumps({
-            "storeId": store_id,
-            "maxUGC": max_ugc,
-            "successCount": success_count
-        })
-        params = {
-            "operationName": "ext_getStoreById",
-            "variables": variables,
-            "operationVersion": "18"
-        }
-        url = f"{self.BASE_URL}/v3?{urlencode(params)}"
+        url = self._DETAILS_URL_TMPL.format(quote(str(store_id), safe=''), int(max_ugc), int(success_count))
+        
+        # Revalidate against what we stored last time; a 304 skips the body
+        cached = self._read_connection().execute(
+            "SELECT etag, last_modified, raw_json FROM stores WHERE store_id = ?", (store_id,)
+        ).fetchone()
+        headers = self._conditional_headers(cached[0], cached[1]) if cached else {}
         
+        response = self._request_with_retry(url, f"store {store_id}", indent="    ", headers=headers)
+        if response is None:
+            return None, NO_VALIDATORS
+        
+        try:
+            if response.status_code == 304 and cached and cached[2]:
+                return orjson.loads(raw_json_text(cached[2])), (cached[0], cached[1])
+            
+            data = orjson.loads(response.content)
+            if "data" in data and "getStoreById" in data["data"]:
+                return data["data"]["getStoreById"], (
+                    response.headers.get('ETag'), response.headers.get('Last-Modified')
+                )
+        except Exception as e:
+            print(f"Error fetching store details for {store_id}: {e}")
+        return None, NO_VALIDATORS
+    
+    def _request_with_retry(self, url: str, label: str, indent: str = "",
+                            headers: Optional[Dict[str, str]] = None) -> Optional[httpx.Response]:
+        """
+        GET a Honey API URL with rate limiting and retries
+        
+        Args:
+            url: Request URL
+            label: What is being fetched, for log messages (e.g. a domain)
+            indent: Prefix for log messages
+            headers: Extra request headers (e.g. conditional GET validators)
+            
+        Returns:
+            Successful (2xx or 304) response, or None once retries are exhausted
+        """
         max_retries = 3
         retry_delay = self.delay
         
         for attempt in range(max_retries):
             try:
-                time.sleep(retry_delay)
-                response = self.session.get(url, timeout=30)
+                self._throttle()
+                self._limiter.acquire()
+                try:
+                    response = self.session.get(url, timeout=30, headers=headers)
+                except httpx.HTTPError:
+                    self._limiter.release(False)
+                    raise
+                except Exception:
+                    self._limiter.release(None)
+                    raise
+                # Only throttling, bans and server errors count as overload
+                if response.status_code in (403, 429) or response.status_code >= 500:
+                    self._limiter.release(False)
+                else:
+                    self._limiter.release(True)
                 
                 # Check for rate limiting
                 if response.status_code == 429:
-                    retry_delay *= 2  # Exponential backoff
-                    print(f"    ⚠️ Rate limited. Waiting {retry_delay}s before retry {attempt + 1}/{max_retries}...")
-                    time.sleep(retry_delay)
+                    print(f"{indent}⚠️ Rate limited on {label}. Retry {attempt + 1}/{max_retries}...")
+                    self._sleep_for_retry(response, attempt)
                     continue
                 
-                response.raise_for_status()
-                data = response.json()
-                
-                if "data" in data and "getStoreById" in data["data"]:
-                    return data["data"]["getStoreById"]
-                return None
+                if response.status_code != 304:
+                    response.raise_for_status()
+                return response
                 
-            except requests.exceptions.Timeout:
-                print(f"    ⚠️ Timeout for store {store_id}. Retry {attempt + 1}/{max_retries}...")
+            except httpx.TimeoutException:
+                print(f"{indent}⚠️ Timeout for {label}. Retry {attempt + 1}/{max_retries}...")
                 retry_delay *= 1.5
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-            except requests.exceptions.RequestException as e:
-                print(f"    ⚠️ Request error for store {store_id}: {e}. Retry {attempt + 1}/{max_retries}...")
+                    self._backoff(retry_delay)
+            except httpx.HTTPError as e:
+                print(f"{indent}⚠️ Request error for {label}: {e}. Retry {attempt + 1}/{max_retries}...")
                 retry_delay *= 1.5
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
+                    self._backoff(retry_delay)
             except Exception as e:
-                print(f"Error fetching store details for {store_id}: {e}")
+                print(f"Error fetching {label}: {e}")
                 break
         
         return None
     
-    def scrape_all_stores(self, max_domains: Optional[int] = None, skip_existing: bool = True):
+    def _fetch_store(self, mapping: Dict) -> Tuple[str, str, Optional[Dict], Validators]:
+        """
+        Fetch details for one store mapping (runs on worker threads)
+        
+        Args:
+            mapping: Dict with storeId and partialURL
+            
+        Returns:
+            Tuple of (store_id, partial_url, details or None, validators)
+        """
+        store_id = mapping.get("storeId")
+        partial_url = mapping.get("partialURL")
+        print(f"    Fetching details for store {store_id} ({partial_url})...")
+        return (store_id, partial_url, *self.get_store_details(store_id))
+    
+    def scrape_all_stores(self, max_domains: Optional[int] = None, skip_existing: bool = True,
+                          fast_bulk: bool = False):
         """
         Scrape all store data and save to database
         
         Args:
             max_domains: Limit number of domains to process (None for all)
             skip_existing: Skip domains already scraped
+            fast_bulk: Drop secondary store indices during the scrape and rebuild them at the end
         """
         print("Starting scrape...")
         start_time = datetime.now()
@@ -416,60 +1055,84 @@ class HoneyScraper:
             domains = domains[:max_domains]
             print(f"Limited to first {max_domains} domains")
         
+        # Load skip-checks into memory once instead of querying per domain/store
+        scraped_domains = self._load_scraped_domains()
+        self._existing_store_ids = {row[0] for row in self.conn.execute("SELECT store_id FROM stores")}
+        
+        # Indices are rebuilt at the end, or by _init_database on the next
+        # start if the scrape is interrupted
+        if fast_bulk:
+            self._drop_indices()
+        
         processed = 0
-        skipped = 0
         errors = 0
         
-        # Process each domain
-        for i, domain in enumerate(domains, 1):
-            # Skip if already scraped
-            if skip_existing and self._domain_scraped(domain):
-                skipped += 1
-                if i % 100 == 0:
-                    print(f"[{i}/{len(domains)}] Skipped {skipped} already-scraped domains...")
-                continue
-            
-            print(f"\n[{i}/{len(domains)}] Processing domain: {domain}")
-            
-            # Get store IDs for domain
-            store_mappings = self.get_store_ids_by_domain(domain)
-            
-            if not store_mappings:
-                print(f"  No stores found for {domain}")
-                self._mark_domain_scraped(domain, 0)
-                continue
-            
-            print(f"  Found {len(store_mappings)} store(s)")
-            domain_store_count = 0
-            
-            # Get details for each store
-            for mapping in store_mappings:
-                store_id = mapping.get("storeId")
-                partial_url = mapping.get("partialURL")
+        # Domains still to scrape, keeping their position for progress output
+        todo = [
+            (i, domain) for i, domain in enumerate(domains, 1)
+            if not (skip_existing and domain in scraped_domains)
+        ]
+        skipped = len(domains) - len(todo)
+        if skipped:
+            print(f"Skipping {skipped} already-scraped domains")
+        
+        # Domain lookups run ahead on the pool (a bounded window of them in
+        # flight) and store details are fetched concurrently per domain.
+        # DB writes stay on this thread since SQLite allows a single writer;
+        # pending writes are committed whenever it has to wait on the network.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            lookups = _bounded_map(executor, self.get_store_ids_by_domain,
+                                   (domain for _, domain in todo), self.workers,
+                                   before_wait=self.flush)
+            # Process each domain
+            for (i, domain), store_mappings in zip(todo, lookups):
+                print(f"\n[{i}/{len(domains)}] Processing domain: {domain}")
                 
-                # Skip if store already exists
-                if skip_existing and self._store_exists(store_id):
-                    print(f"    ⏭ Store {store_id} already in database")
-                    domain_store_count += 1
+                if not store_mappings:
+                    print(f"  No stores found for {domain}")
+                    self._mark_domain_scraped(domain, 0)
                     continue
                 
-                print(f"    Fetching details for store {store_id} ({partial_url})...")
-                store_details = self.get_store_details(store_id)
+                print(f"  Found {len(store_mappings)} store(s)")
+                domain_store_count = 0
                 
-                if store_details:
-                    self._save_store_to_db(domain, store_id, partial_url, store_details)
-                    processed += 1
-                    domain_store_count += 1
-                    print(f"      ✓ {store_details.get('name', 'Unknown')} - {store_details.get('country', 'N/A')}")
-                else:
-                    errors += 1
-            
-            # Mark domain as scraped
-            self._mark_domain_scraped(domain, domain_store_count)
-            
-            # Progress update
-            if i % 100 == 0:
-                print(f"\n  Progress: {processed} stores saved, {skipped} domains skipped, {errors} errors")
+                # Skip stores that already exist
+                to_fetch = []
+                for mapping in store_mappings:
+                    store_id = mapping.get("storeId")
+                    if skip_existing and store_id in self._existing_store_ids:
+                        print(f"    ⏭ Store {store_id} already in database")
+                        domain_store_count += 1
+                        continue
+                    to_fetch.append(mapping)
+                
+                # Get details for the remaining stores
+                if to_fetch:
+                    self.flush()
+                to_save = []
+                for store_id, partial_url, store_details, validators in executor.map(self._fetch_store, to_fetch):
+                    if store_details:
+                        to_save.append((store_id, partial_url, store_details, validators))
+                        processed += 1
+                        domain_store_count += 1
+                        print(f"      ✓ {store_details.get('name', 'Unknown')} - {store_details.get('country', 'N/A')}")
+                    else:
+                        errors += 1
+                
+                # Save the domain's stores in one batch
+                self._existing_store_ids.update(self._save_stores_to_db(domain, to_save))
+                
+                # Mark domain as scraped
+                self._mark_domain_scraped(domain, domain_store_count)
+                
+                # Progress update
+                if i % 100 == 0:
+                    print(f"\n  Progress: {processed} stores saved, {skipped} domains skipped, {errors} errors")
+        
+        self.flush()
+        if fast_bulk:
+            print("Rebuilding indices...")
+            self._create_indices()
         
         elapsed = datetime.now() - start_time
         print(f"\n{'='*60}")
@@ -482,10 +1145,22 @@ class HoneyScraper:
         print(f"Database: {self.db_path}")
         print(f"{'='*60}")
     
+    def close(self):
+        """Commit pending writes and close the database and HTTP connections"""
+        self.session.close()
+        for conn in self._read_connections:
+            conn.close()
+        self._read_connections = []
+        self._thread_local = threading.local()
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+    
     def _save_data(self, data: List[Dict], filename: str):
         """Save data to JSON file (legacy method for export)"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
     
     def export_to_json(self, output_file: str = "honey_stores.json", limit: Optional[int] = None):
         """
@@ -497,30 +1172,11 @@ class HoneyScraper:
         """
         print(f"Exporting database to {output_file}...")
         
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM stores"
-        if limit:
-            query += f" LIMIT {limit}"
+        # Stream rows straight to the file so memory stays flat on large databases
+        with open(output_file, 'wb') as f:
+            count = _write_chunks(f, iter_json_export(self.conn, limit))
         
-        cursor.execute(query)
-        stores = []
-        
-        for row in cursor.fetchall():
-            store_data = dict(row)
-            # Parse raw JSON back to object
-            if store_data.get('raw_json'):
-                store_data['details'] = json.loads(store_data['raw_json'])
-            stores.append(store_data)
-        
-        conn.close()
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(stores, f, indent=2, ensure_ascii=False)
-        
-        print(f"Exported {len(stores)} stores to {output_file}")
+        print(f"Exported {count} stores to {output_file}")
     
     def export_to_csv(self, csv_file: str = "honey_stores.csv", limit: Optional[int] = None):
         """
@@ -532,63 +1188,31 @@ class HoneyScraper:
         """
         print(f"Exporting database to {csv_file}...")
         
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT 
-                s.domain, s.store_id, s.partial_url, s.name, s.country, s.url,
-                s.active, s.supported, s.shoppers_30d, s.logo_url, s.created, s.updated,
-                COUNT(c.id) as num_coupons
-            FROM stores s
-            LEFT JOIN coupons c ON s.store_id = c.store_id
-            GROUP BY s.store_id
-        """
-        if limit:
-            query += f" LIMIT {limit}"
-        
-        cursor.execute(query)
-        
         with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-            fieldnames = [
-                'domain', 'store_id', 'partial_url', 'name', 'country', 'url',
-                'active', 'supported', 'shoppers_30d', 'num_coupons',
-                'logo_url', 'created', 'updated'
-            ]
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            count = 0
-            for row in cursor.fetchall():
-                writer.writerow(dict(row))
-                count += 1
+            count = _write_chunks(f, iter_csv_export(self.conn, limit))
         
-        conn.close()
         print(f"CSV export complete: {count} stores in {csv_file}")
     
     def get_stats(self) -> Dict:
         """Get database statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         stats = {}
         
-        # Total stores
-        cursor.execute("SELECT COUNT(*) FROM stores")
-        stats['total_stores'] = cursor.fetchone()[0]
+        # Total and active stores in one pass (covered by idx_stores_active_country)
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(CASE WHEN active = 1 THEN 1 ELSE 0 END), 0)
+            FROM stores
+        """)
+        stats['total_stores'], stats['active_stores'] = cursor.fetchone()
         
         # Total domains scraped
         cursor.execute("SELECT COUNT(*) FROM scraped_domains")
         stats['domains_scraped'] = cursor.fetchone()[0]
         
-        # Total coupons
-        cursor.execute("SELECT COUNT(*) FROM coupons")
-        stats['total_coupons'] = cursor.fetchone()[0]
-        
-        # Active stores
-        cursor.execute("SELECT COUNT(*) FROM stores WHERE active = 1")
-        stats['active_stores'] = cursor.fetchone()[0]
+        # Total coupons and stores with coupons in one pass
+        cursor.execute("SELECT COUNT(*), COUNT(DISTINCT store_id) FROM coupons")
+        stats['total_coupons'], stats['stores_with_coupons'] = cursor.fetchone()
         
         # Stores by country (top 10)
         cursor.execute("""
@@ -601,14 +1225,6 @@ class HoneyScraper:
         """)
         stats['top_countries'] = dict(cursor.fetchall())
         
-        # Stores with coupons
-        cursor.execute("""
-            SELECT COUNT(DISTINCT store_id) 
-            FROM coupons
-        """)
-        stats['stores_with_coupons'] = cursor.fetchone()[0]
-        
-        conn.close()
         return stats
     
     def print_stats(self):
@@ -633,81 +1249,84 @@ def main():
     import sys
     
     scraper = HoneyScraper(delay=0.5)  # 0.5 second delay between requests
+    try:
     
-    # Check for command line arguments (for service mode)
-    if len(sys.argv) > 1:
-        mode = sys.argv[1].lower()
-        if mode in ['auto', 'service', 'resume']:
-            print("Running in automatic mode (service/resume)...")
-            scraper.scrape_all_stores(skip_existing=True)
-            scraper.print_stats()
-            return
-        elif mode == 'stats':
+        # Check for command line arguments (for service mode)
+        if len(sys.argv) > 1:
+            mode = sys.argv[1].lower()
+            if mode in ['auto', 'service', 'resume']:
+                print("Running in automatic mode (service/resume)...")
+                scraper.scrape_all_stores(skip_existing=True)
+                scraper.print_stats()
+                return
+            elif mode == 'stats':
+                scraper.print_stats()
+                return
+            elif mode.startswith('limit='):
+                try:
+                    limit = int(mode.split('=')[1])
+                    scraper.scrape_all_stores(max_domains=limit)
+                    scraper.print_stats()
+                    return
+                except (ValueError, IndexError):
+                    print(f"Invalid limit: {mode}")
+                    sys.exit(1)
+    
+        # Interactive mode
+        print("=" * 60)
+        print("HONEY STORE SCRAPER")
+        print("=" * 60)
+        print("\nChoose action:")
+        print("1. Start scraping (test mode - 10 domains)")
+        print("2. Start scraping (full - all ~178k domains)")
+        print("3. Start scraping (custom limit)")
+        print("4. View database statistics")
+        print("5. Export database to JSON")
+        print("6. Export database to CSV")
+        print("7. Resume scraping (continue from where left off)")
+    
+        choice = input("\nEnter choice (1-7): ").strip()
+    
+        if choice == "1":
+            scraper.scrape_all_stores(max_domains=10)
             scraper.print_stats()
-            return
-        elif mode.startswith('limit='):
+        elif choice == "2":
+            confirm = input("This will take many hours. Continue? (yes/no): ").strip().lower()
+            if confirm == "yes":
+                scraper.scrape_all_stores()
+                scraper.print_stats()
+            else:
+                print("Cancelled.")
+        elif choice == "3":
             try:
-                limit = int(mode.split('=')[1])
+                limit = int(input("Enter number of domains to scrape: ").strip())
                 scraper.scrape_all_stores(max_domains=limit)
                 scraper.print_stats()
-                return
-            except (ValueError, IndexError):
-                print(f"Invalid limit: {mode}")
-                sys.exit(1)
-    
-    # Interactive mode
-    print("=" * 60)
-    print("HONEY STORE SCRAPER")
-    print("=" * 60)
-    print("\nChoose action:")
-    print("1. Start scraping (test mode - 10 domains)")
-    print("2. Start scraping (full - all ~178k domains)")
-    print("3. Start scraping (custom limit)")
-    print("4. View database statistics")
-    print("5. Export database to JSON")
-    print("6. Export database to CSV")
-    print("7. Resume scraping (continue from where left off)")
-    
-    choice = input("\nEnter choice (1-7): ").strip()
-    
-    if choice == "1":
-        scraper.scrape_all_stores(max_domains=10)
-        scraper.print_stats()
-    elif choice == "2":
-        confirm = input("This will take many hours. Continue? (yes/no): ").strip().lower()
-        if confirm == "yes":
-            scraper.scrape_all_stores()
-            scraper.print_stats()
-        else:
-            print("Cancelled.")
-    elif choice == "3":
-        try:
-            limit = int(input("Enter number of domains to scrape: ").strip())
-            scraper.scrape_all_stores(max_domains=limit)
-            scraper.print_stats()
-        except ValueError:
-            print("Invalid number")
-    elif choice == "4":
-        scraper.print_stats()
-    elif choice == "5":
-        output = input("Output file (default: honey_stores.json): ").strip() or "honey_stores.json"
-        limit_str = input("Limit (press Enter for all): ").strip()
-        limit = int(limit_str) if limit_str else None
-        scraper.export_to_json(output, limit)
-    elif choice == "6":
-        output = input("Output file (default: honey_stores.csv): ").strip() or "honey_stores.csv"
-        limit_str = input("Limit (press Enter for all): ").strip()
-        limit = int(limit_str) if limit_str else None
-        scraper.export_to_csv(output, limit)
-    elif choice == "7":
-        confirm = input("Resume scraping all remaining domains? (yes/no): ").strip().lower()
-        if confirm == "yes":
-            scraper.scrape_all_stores(skip_existing=True)
+            except ValueError:
+                print("Invalid number")
+        elif choice == "4":
             scraper.print_stats()
+        elif choice == "5":
+            output = input("Output file (default: honey_stores.json): ").strip() or "honey_stores.json"
+            limit_str = input("Limit (press Enter for all): ").strip()
+            limit = int(limit_str) if limit_str else None
+            scraper.export_to_json(output, limit)
+        elif choice == "6":
+            output = input("Output file (default: honey_stores.csv): ").strip() or "honey_stores.csv"
+            limit_str = input("Limit (press Enter for all): ").strip()
+            limit = int(limit_str) if limit_str else None
+            scraper.export_to_csv(output, limit)
+        elif choice == "7":
+            confirm = input("Resume scraping all remaining domains? (yes/no): ").strip().lower()
+            if confirm == "yes":
+                scraper.scrape_all_stores(skip_existing=True)
+                scraper.print_stats()
+            else:
+                print("Cancelled.")
         else:
-            print("Cancelled.")
-    else:
-        print("Invalid choice")
+            print("Invalid choice")
+    finally:
+        scraper.close()
 
 
 if __name__ == "__main__":
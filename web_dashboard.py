@@ -3,17 +3,74 @@ Honey Scraper Web Dashboard
 Flask web application for monitoring and controlling the scraper
 """
 
-from flask import Flask, render_template, jsonify, request, send_file, make_response
-from scraper import HoneyScraper
+from flask import Flask, Response, render_template, jsonify, request, make_response
+from flask.json.provider import DefaultJSONProvider
+from scraper import NO_VALIDATORS, HoneyScraper, _bounded_map, init_schema, iter_csv_export, iter_json_export, raw_json_text
 import sqlite3
-import json
+import atexit
+import functools
+import logging
+import orjson
+import queue
+import sys
 import threading
 import time
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set, Tuple
 import os
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson (falls back to Flask's default for other types)"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return self._encode(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of the base implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+    
+    def _encode(self, obj) -> bytes:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+
+
+logger = logging.getLogger(__name__)
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Send this module's log records through a queue to a background writer
+    
+    The scrape loop only enqueues records; the listener thread does the
+    actual console writes. Returns the started listener (stop it on exit).
+    """
+    log_queue = queue.Queue()
+    # stdout, so progress lands in the service's regular log, not the error log
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = QueueListener(log_queue, console)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+# Set up on import so records aren't dropped when the app is imported
+# (e.g. by a WSGI server) instead of run through main()
+_log_listener = setup_logging()
+atexit.register(_log_listener.stop)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = 'honey-scraper-secret-key-change-me'
 
 # Global scraper state
@@ -24,6 +81,7 @@ scraper_state = {
     'current_domain': None,
     'domains_processed': 0,
     'total_domains': 0,
+    'already_scraped': 0,
     'stores_saved': 0,
     'errors': 0,
     'consecutive_errors': 0,
@@ -36,59 +94,252 @@ scraper_state = {
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'honey_stores.db')
 
+# journal_mode is persistent in the database file, so it only needs setting once
+_PRAGMAS_APPLIED = False
+
+# Connections kept open between requests so SQLite's page cache stays warm
+_POOL_SIZE = 8
+_pool: Optional['_ConnPool'] = None
+_pool_lock = threading.Lock()
+
+
+def _create_connection() -> sqlite3.Connection:
+    """Open a database connection with the dashboard pragmas applied"""
+    global _PRAGMAS_APPLIED
+    # Pooled connections are handed between request threads
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    if not _PRAGMAS_APPLIED:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _PRAGMAS_APPLIED = True
+    conn.executescript("""
+        PRAGMA synchronous=NORMAL;
+        PRAGMA cache_size=-65536;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+    """)
+    return conn
+
+
+def fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict]:
+    """Fetch the remaining rows as dicts, reading the column names once"""
+    cols = [d[0] for d in cursor.description]
+    return [dict(zip(cols, row)) for row in cursor.fetchall()]
 
+
+class _ConnPool:
+    """Fixed-size pool of SQLite connections shared by request threads"""
+    
+    def __init__(self, size: int):
+        self._connections = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(_create_connection())
+    
+    def get(self, timeout: float = 30) -> sqlite3.Connection:
+        """Check out a connection, replacing it if it no longer works"""
+        conn = self._connections.get(timeout=timeout)
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.Error:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            try:
+                conn = _create_connection()
+            except Exception:
+                # Keep the slot; the next check-out will try again
+                self._connections.put(conn)
+                raise
+        return conn
+    
+    def put(self, conn: sqlite3.Connection):
+        """Return a connection, discarding any uncommitted work"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+        self._connections.put(conn)
+
+
+@contextmanager
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled database connection for the duration of a with block"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnPool(_POOL_SIZE)
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put(conn)
+
+
+# Header counters for /api/stats
+STATS_COUNTS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM stores),
+        (SELECT COUNT(*) FROM scraped_domains),
+        (SELECT COUNT(*) FROM coupons),
+        (SELECT COUNT(*) FROM stores WHERE active = 1),
+        (SELECT COUNT(DISTINCT store_id) FROM coupons)
+"""
+
+# Short-lived cache of polled JSON responses, see ttl_cache
+_response_cache: Dict[Tuple, Tuple[float, bytes, int, str]] = {}
+_response_cache_lock = threading.Lock()
+_RESPONSE_CACHE_MAX = 256
+# Bumped on every scraper_state change so cached status responses go stale
+_state_version = 0
+
+
+def ttl_cache(ttl: float = 3.0, track_state: bool = False):
+    """
+    Cache a view's successful response for ttl seconds
+    
+    Args:
+        ttl: Seconds a cached response stays valid
+        track_state: Also key on the scraper state version, so the cache is
+            bypassed as soon as update_scraper_state changes something
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                   _state_version if track_state else None)
+            now = time.monotonic()
+            with _response_cache_lock:
+                hit = _response_cache.get(key)
+            if hit and now - hit[0] < ttl:
+                return app.response_class(hit[1], status=hit[2], mimetype=hit[3])
+            
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                with _response_cache_lock:
+                    if len(_response_cache) >= _RESPONSE_CACHE_MAX:
+                        _response_cache.clear()
+                    _response_cache[key] = (now, response.get_data(), response.status_code, response.mimetype)
+            return response
+        return wrapper
+    return decorator
+
+
+# Guards scraper_state writes and read-modify-write sequences
+_state_lock = threading.RLock()
+# Mirrors scraper_state['should_stop'] so the scrape loop can check it without locking
+_stop_event = threading.Event()
 
 
 def update_scraper_state(key: str, value):
     """Thread-safe state update"""
-    scraper_state[key] = value
+    global _state_version
+    with _state_lock:
+        scraper_state[key] = value
+        _state_version += 1
+        if key == 'should_stop':
+            if value:
+                _stop_event.set()
+            else:
+                _stop_event.clear()
+
+
+def increment_state(key: str, by: int = 1) -> int:
+    """Atomically add to a numeric state value and return the new value"""
+    with _state_lock:
+        value = scraper_state.get(key, 0) + by
+        update_scraper_state(key, value)
+        return value
 
 
 class MonitoredScraper(HoneyScraper):
     """Scraper with progress monitoring and error handling"""
     
+    def _record_error(self, error: str):
+        """Count a failed request, stopping only if backing off hasn't helped"""
+        update_scraper_state('last_error', error)
+        consecutive = increment_state('consecutive_errors')
+        
+        # The adaptive limiter already slows down on errors; stop only as a
+        # last resort once it is fully backed off and requests still fail
+        if consecutive >= 10 and self._limiter.backed_off:
+            logger.error("⚠️ CRITICAL: %d consecutive errors at minimum request rate. Stopping to prevent ban.", consecutive)
+            update_scraper_state('should_stop', True)
+    
+    def _request_with_retry(self, url: str, label: str, indent: str = "",
+                            headers: Optional[Dict[str, str]] = None):
+        """Override to count requests that failed after every retry"""
+        response = super()._request_with_retry(url, label, indent, headers)
+        if response is None:
+            self._record_error(f"Request failed for {label}")
+        else:
+            # Reset consecutive errors on success
+            update_scraper_state('consecutive_errors', 0)
+        return response
+    
     def get_store_ids_by_domain(self, domain: str):
         """Override to add error handling"""
         try:
-            result = super().get_store_ids_by_domain(domain)
-            # Reset consecutive errors on success
-            if result:
-                update_scraper_state('consecutive_errors', 0)
-            return result
+            return super().get_store_ids_by_domain(domain)
         except Exception as e:
-            update_scraper_state('last_error', str(e))
-            consecutive = scraper_state.get('consecutive_errors', 0) + 1
-            update_scraper_state('consecutive_errors', consecutive)
-            
-            # Stop if too many consecutive errors (likely blocked)
-            if consecutive >= 10:
-                print(f"⚠️ CRITICAL: {consecutive} consecutive errors. Stopping to prevent ban.")
-                update_scraper_state('should_stop', True)
+            self._record_error(str(e))
             return []
     
     def get_store_details(self, store_id: str, max_ugc: int = 3, success_count: int = 1):
         """Override to add error handling"""
         try:
-            result = super().get_store_details(store_id, max_ugc, success_count)
-            # Reset consecutive errors on success
-            if result:
-                update_scraper_state('consecutive_errors', 0)
-            return result
+            return super().get_store_details(store_id, max_ugc, success_count)
         except Exception as e:
-            update_scraper_state('last_error', str(e))
-            consecutive = scraper_state.get('consecutive_errors', 0) + 1
-            update_scraper_state('consecutive_errors', consecutive)
+            self._record_error(str(e))
+            return None, NO_VALIDATORS
+    
+    def _claim_store(self, store_id: str) -> bool:
+        """Claim a store for this run; False if another domain's worker already has it"""
+        with self._claimed_lock:
+            if store_id in self._claimed_ids:
+                return False
+            self._claimed_ids.add(store_id)
+            return True
+    
+    def _process_domain(self, domain: str, skip_existing: bool):
+        """
+        Fetch a domain's stores on a pool worker (no database writes)
+        
+        Returns (store_mappings, fetched, complete): fetched holds a
+        (store_id, partial_url, details, validators) tuple per store requested,
+        with details None if the request failed, and complete is False if a
+        stop signal cut the domain short.
+        """
+        if _stop_event.is_set():
+            return [], [], False
+        
+        # Get store IDs for domain
+        store_mappings = self.get_store_ids_by_domain(domain)
+        
+        # One lookup per domain instead of a SELECT per store
+        existing_ids = (
+            self._existing_store_ids_in([m.get("storeId") for m in store_mappings],
+                                        conn=self._read_connection())
+            if skip_existing and store_mappings else set()
+        )
+        
+        # Get details for each store
+        fetched = []
+        for mapping in store_mappings:
+            # Check for stop signal
+            if _stop_event.is_set():
+                return store_mappings, fetched, False
             
-            # Stop if too many consecutive errors
-            if consecutive >= 10:
-                print(f"⚠️ CRITICAL: {consecutive} consecutive errors. Stopping to prevent ban.")
-                update_scraper_state('should_stop', True)
-            return None
+            store_id = mapping.get("storeId")
+            if store_id in existing_ids:
+                continue
+            # Domains in flight can list the same store before either is saved
+            if skip_existing and not self._claim_store(store_id):
+                continue
+            fetched.append((store_id, mapping.get("partialURL"), *self.get_store_details(store_id)))
+        
+        return store_mappings, fetched, True
     
     def scrape_all_stores(self, max_domains: Optional[int] = None, skip_existing: bool = True):
         """Scrape with progress updates and error handling"""
@@ -100,109 +351,107 @@ class MonitoredScraper(HoneyScraper):
         update_scraper_state('last_error', None)
         
         try:
-            print("Starting monitored scrape...")
+            logger.info("Starting monitored scrape...")
             start_time = datetime.now()
             
             # Get all domains
             domains = self.get_supported_domains()
             if not domains:
-                print("No domains found. Exiting.")
+                logger.warning("No domains found. Exiting.")
                 update_scraper_state('last_error', 'No domains found in domains list')
                 return
             
-            print(f"Total domains available: {len(domains)}")
+            logger.info("Total domains available: %d", len(domains))
             
             if max_domains:
                 domains = domains[:max_domains]
-                print(f"Limited to {max_domains} domains")
+                logger.info("Limited to %d domains", max_domains)
             
+            # Drop already-scraped domains once, up front, so the loop below
+            # only sees domains with work to do
             if skip_existing:
-                # Count how many will be skipped
-                already_scraped = sum(1 for d in domains if self._domain_scraped(d))
-                print(f"Already scraped: {already_scraped}/{len(domains)} domains")
-                if already_scraped == len(domains):
-                    print("⚠️ All selected domains already scraped!")
+                scraped_domains = self._load_scraped_domains()
+                domains_to_do = [d for d in domains if d not in scraped_domains]
+                skipped = len(domains) - len(domains_to_do)
+                logger.info("Already scraped: %d/%d domains", skipped, len(domains))
+                if not domains_to_do:
+                    logger.warning("⚠️ All selected domains already scraped!")
                     update_scraper_state('last_error', 'All selected domains already scraped')
                     return
+            else:
+                domains_to_do = domains
+                skipped = 0
             
-            update_scraper_state('total_domains', len(domains))
+            update_scraper_state('already_scraped', skipped)
+            update_scraper_state('total_domains', len(domains_to_do))
             
             processed = 0
-            skipped = 0
             errors = 0
+            last_progress = 0.0
             
-            # Process each domain
-            for i, domain in enumerate(domains, 1):
-                # Check for stop signal
-                if scraper_state.get('should_stop', False):
-                    print("\n⚠️ Stop signal received. Halting scrape.")
-                    break
-                
-                update_scraper_state('current_domain', domain)
-                update_scraper_state('domains_processed', i)
-                
-                # Skip if already scraped
-                if skip_existing and self._domain_scraped(domain):
-                    print(f"  ⏭️  Skipping {domain} (already scraped)")
-                    skipped += 1
-                    continue
-                
-                print(f"\n[{i}/{len(domains)}] Processing domain: {domain}")
-                
-                # Get store IDs for domain
-                store_mappings = self.get_store_ids_by_domain(domain)
-                
-                if not store_mappings:
-                    self._mark_domain_scraped(domain, 0)
-                    continue
-                
-                domain_store_count = 0
-                
-                # Get details for each store
-                for mapping in store_mappings:
+            # Stores fetched so far this run, shared by the pool workers
+            self._claimed_ids: Set[str] = set()
+            self._claimed_lock = threading.Lock()
+            
+            # Domains are fetched on the pool, a bounded window of them at a
+            # time; results come back in order and are written on this thread.
+            # Each domain commits with its scraped_domains row, unless the next
+            # domain's result is already in hand to join the same transaction.
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = _bounded_map(
+                    executor, lambda domain: self._process_domain(domain, skip_existing),
+                    domains_to_do, self.workers, before_wait=self.flush
+                )
+                for i, (domain, (store_mappings, fetched, complete)) in enumerate(zip(domains_to_do, results), 1):
                     # Check for stop signal
-                    if scraper_state.get('should_stop', False):
+                    if _stop_event.is_set():
+                        logger.warning("⚠️ Stop signal received. Halting scrape.")
                         break
                     
-                    store_id = mapping.get("storeId")
-                    partial_url = mapping.get("partialURL")
+                    update_scraper_state('current_domain', domain)
+                    update_scraper_state('domains_processed', i)
                     
-                    if skip_existing and self._store_exists(store_id):
-                        domain_store_count += 1
-                        continue
+                    logger.debug("[%d/%d] Processing domain: %s", i, len(domains_to_do), domain)
                     
-                    store_details = self.get_store_details(store_id)
+                    # Save the domain's stores in one batch
+                    to_save = [store for store in fetched if store[2]]
+                    processed += len(self._save_stores_to_db(domain, to_save))
+                    errors += len(fetched) - len(to_save)
+                    update_scraper_state('stores_saved', processed)
+                    update_scraper_state('errors', errors)
                     
-                    if store_details:
-                        self._save_store_to_db(domain, store_id, partial_url, store_details)
-                        processed += 1
-                        update_scraper_state('stores_saved', processed)
-                    else:
-                        errors += 1
-                        update_scraper_state('errors', errors)
+                    # Mark domain as scraped, unless a stop cut it short
+                    if complete:
+                        self._mark_domain_scraped(domain, len(store_mappings))
                     
-                    domain_store_count += 1
-                
-                # Mark domain as scraped
-                self._mark_domain_scraped(domain, domain_store_count)
+                    # Progress line at most once a second instead of per domain
+                    now = time.monotonic()
+                    if now - last_progress >= 1.0:
+                        last_progress = now
+                        logger.info("[%d/%d] %s - %d stores saved, %d errors",
+                                    i, len(domains_to_do), domain, processed, errors)
+                    
+                    # Check if we should stop due to errors
+                    if _stop_event.is_set():
+                        logger.warning("⚠️ Too many errors. Stopping to prevent ban.")
+                        break
                 
-                # Check if we should stop due to errors
-                if scraper_state.get('should_stop', False):
-                    print("\n⚠️ Too many errors. Stopping to prevent ban.")
-                    break
+                # Commit before leaving the pool waits on in-flight requests
+                self.flush()
             
             elapsed = datetime.now() - start_time
-            print(f"\nScraping complete! Processed: {processed}, Skipped: {skipped}, Errors: {errors}")
-            print(f"Time elapsed: {elapsed}")
+            logger.info("Scraping complete! Processed: %d, Skipped: %d, Errors: %d", processed, skipped, errors)
+            logger.info("Time elapsed: %s", elapsed)
             
             if errors > 0:
-                print(f"\n⚠️ Total errors: {errors}")
+                logger.warning("⚠️ Total errors: %d", errors)
                 if scraper_state.get('consecutive_errors', 0) >= 5:
-                    print("⚠️ WARNING: Multiple consecutive errors detected.")
-                    print("   This may indicate rate limiting or IP blocking.")
-                    print("   Consider increasing delay or waiting before resuming.")
+                    logger.warning("⚠️ WARNING: Multiple consecutive errors detected. "
+                                   "This may indicate rate limiting or IP blocking. "
+                                   "Consider increasing delay or waiting before resuming.")
             
         finally:
+            self.close()
             update_scraper_state('running', False)
             update_scraper_state('current_domain', None)
             update_scraper_state('should_stop', False)
@@ -219,49 +468,36 @@ def index():
 
 
 @app.route('/api/stats')
+@ttl_cache(ttl=3.0)
 def api_stats():
     """Get database statistics"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Basic stats
-        cursor.execute("SELECT COUNT(*) FROM stores")
-        total_stores = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM scraped_domains")
-        domains_scraped = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM coupons")
-        total_coupons = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM stores WHERE active = 1")
-        active_stores = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(DISTINCT store_id) FROM coupons")
-        stores_with_coupons = cursor.fetchone()[0]
-        
-        # Top countries
-        cursor.execute("""
-            SELECT country, COUNT(*) as count 
-            FROM stores 
-            WHERE country IS NOT NULL
-            GROUP BY country 
-            ORDER BY count DESC 
-            LIMIT 10
-        """)
-        top_countries = [dict(row) for row in cursor.fetchall()]
-        
-        # Recent stores
-        cursor.execute("""
-            SELECT name, country, url, updated 
-            FROM stores 
-            ORDER BY updated DESC 
-            LIMIT 10
-        """)
-        recent_stores = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Basic stats in one statement
+            cursor.execute(STATS_COUNTS_SQL)
+            total_stores, domains_scraped, total_coupons, active_stores, stores_with_coupons = cursor.fetchone()
+            
+            # Top countries
+            cursor.execute("""
+                SELECT country, COUNT(*) as count 
+                FROM stores 
+                WHERE country IS NOT NULL
+                GROUP BY country 
+                ORDER BY count DESC 
+                LIMIT 10
+            """)
+            top_countries = fetch_dicts(cursor)
+            
+            # Recent stores
+            cursor.execute("""
+                SELECT name, country, url, updated 
+                FROM stores 
+                ORDER BY updated DESC 
+                LIMIT 10
+            """)
+            recent_stores = fetch_dicts(cursor)
         
         return jsonify({
             'success': True,
@@ -280,11 +516,14 @@ def api_stats():
 
 
 @app.route('/api/scraper/status')
+@ttl_cache(ttl=3.0, track_state=True)
 def api_scraper_status():
     """Get scraper status"""
+    with _state_lock:
+        status = dict(scraper_state)
     return jsonify({
         'success': True,
-        'status': scraper_state
+        'status': status
     })
 
 
@@ -293,9 +532,6 @@ def api_scraper_start():
     """Start scraper"""
     global scraper_instance, scraper_thread
     
-    if scraper_state['running']:
-        return jsonify({'success': False, 'error': 'Scraper is already running'}), 400
-    
     data = request.json or {}
     max_domains = data.get('max_domains', None)
     skip_existing = data.get('skip_existing', True)
@@ -306,9 +542,19 @@ def api_scraper_start():
         except ValueError:
             return jsonify({'success': False, 'error': 'Invalid max_domains value'}), 400
     
+    # Claim the run under the lock so concurrent requests can't both start one
+    with _state_lock:
+        if scraper_state['running']:
+            return jsonify({'success': False, 'error': 'Scraper is already running'}), 400
+        update_scraper_state('running', True)
+    
     # Start scraper in background thread
     delay = scraper_state.get('delay', 0.5)
-    scraper_instance = MonitoredScraper(delay=delay, db_path=DB_PATH)
+    try:
+        scraper_instance = MonitoredScraper(delay=delay, db_path=DB_PATH)
+    except Exception:
+        update_scraper_state('running', False)
+        raise
     
     # Determine mode for display
     if max_domains:
@@ -370,82 +616,116 @@ def api_scraper_delay():
         return jsonify({'success': False, 'error': f'Invalid delay value: {str(e)}'}), 400
 
 
+@app.route('/api/domains/refresh', methods=['POST'])
+def api_domains_refresh():
+    """Drop the cached supported-domain list so the next scrape refetches it"""
+    HoneyScraper.clear_domains_cache()
+    return jsonify({'success': True, 'message': 'Domain list will be refetched on the next scrape'})
+
+
+def _make_stores_cursor(store: Dict) -> str:
+    """Cursor pointing just after this store in /api/stores order"""
+    updated = '' if store['updated'] is None else store['updated']
+    return f"{updated}:{store['store_id']}"
+
+
+def _parse_stores_cursor(value: str) -> Tuple[Optional[int], str]:
+    """Split an /api/stores cursor ("<updated>:<store_id>") into its parts"""
+    updated, sep, store_id = value.partition(':')
+    if not sep:
+        raise ValueError(value)
+    return (int(updated) if updated else None), store_id
+
+
 @app.route('/api/stores')
 def api_stores():
-    """Get stores with pagination and search"""
+    """
+    Get stores with pagination and search
+    
+    Pass ?cursor= (empty for the first page, then each response's
+    next_cursor) for keyset pagination, which costs the same at any depth.
+    ?page= is deprecated (responses carry a Deprecation header): it has to
+    skip every earlier row.
+    """
     try:
         page = request.args.get('page', 1, type=int)
+        after = request.args.get('cursor', type=str)
         per_page = request.args.get('per_page', 50, type=int)
         search = request.args.get('search', '', type=str)
         country = request.args.get('country', '', type=str)
         active_only = request.args.get('active_only', 'false', type=str).lower() == 'true'
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Build query
-        where_clauses = []
-        params = []
-        
-        if search:
-            where_clauses.append("(name LIKE ? OR domain LIKE ? OR url LIKE ?)")
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param])
-        
-        if country:
-            where_clauses.append("country = ?")
-            params.append(country)
-        
-        if active_only:
-            where_clauses.append("active = 1")
-        
-        where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-        
-        # Get total count (use simple query without alias)
-        cursor.execute(f"SELECT COUNT(*) FROM stores WHERE {where_sql}", params)
-        total = cursor.fetchone()[0]
-        
-        # Get stores (rebuild where clause with table alias for JOIN query)
-        where_clauses_aliased = []
-        if search:
-            where_clauses_aliased.append("(s.name LIKE ? OR s.domain LIKE ? OR s.url LIKE ?)")
-        if country:
-            where_clauses_aliased.append("s.country = ?")
-        if active_only:
-            where_clauses_aliased.append("s.active = 1")
-        
-        where_sql_aliased = " AND ".join(where_clauses_aliased) if where_clauses_aliased else "1=1"
-        
-        offset = (page - 1) * per_page
-        query = f"""
-            SELECT 
-                s.store_id, s.name, s.domain, s.country, s.url, s.active, 
-                s.supported, s.shoppers_30d, s.created, s.updated,
-                COUNT(c.id) as coupon_count
-            FROM stores s
-            LEFT JOIN coupons c ON s.store_id = c.store_id
-            WHERE {where_sql_aliased}
-            GROUP BY s.store_id
-            ORDER BY s.updated DESC
-            LIMIT ? OFFSET ?
-        """
-        params.extend([per_page, offset])
-        
-        cursor.execute(query, params)
-        stores = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        return jsonify({
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Build query
+            where_clauses = []
+            params = []
+            
+            if search:
+                where_clauses.append("(name LIKE ? OR domain LIKE ? OR url LIKE ?)")
+                search_param = f"%{search}%"
+                params.extend([search_param, search_param, search_param])
+            
+            if country:
+                where_clauses.append("country = ?")
+                params.append(country)
+            
+            if active_only:
+                where_clauses.append("active = 1")
+            
+            where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+            
+            # Get total count
+            cursor.execute(f"SELECT COUNT(*) FROM stores WHERE {where_sql}", params)
+            total = cursor.fetchone()[0]
+            
+            def select_stores(extra_where: str, extra_params: List, limit: int, offset: int = 0) -> List[Dict]:
+                # coupon_count is kept up to date by the scraper
+                cursor.execute(f"""
+                    SELECT 
+                        store_id, name, domain, country, url, active, 
+                        supported, shoppers_30d, created, updated, coupon_count
+                    FROM stores
+                    WHERE {where_sql} AND {extra_where}
+                    ORDER BY updated DESC, store_id DESC
+                    LIMIT ? OFFSET ?
+                """, params + extra_params + [limit, offset])
+                return fetch_dicts(cursor)
+            
+            # Rows after the cursor in (updated DESC, store_id DESC) order.
+            # The row-value comparison seeks idx_stores_updated; it never
+            # matches NULL updated values, which sort last and are read as a
+            # separate tail once the dated rows run out.
+            if after:
+                after_updated, after_store_id = _parse_stores_cursor(after)
+                if after_updated is None:
+                    stores = select_stores("updated IS NULL AND store_id < ?", [after_store_id], per_page)
+                else:
+                    stores = select_stores("(updated, store_id) < (?, ?)", [after_updated, after_store_id], per_page)
+                    if len(stores) < per_page:
+                        stores += select_stores("updated IS NULL", [], per_page - len(stores))
+            elif after is not None:
+                stores = select_stores("1=1", [], per_page)
+            else:
+                stores = select_stores("1=1", [], per_page, (page - 1) * per_page)
+        
+        response = jsonify({
             'success': True,
             'stores': stores,
             'pagination': {
-                'page': page,
+                'page': page if after is None else None,
                 'per_page': per_page,
                 'total': total,
-                'pages': (total + per_page - 1) // per_page
+                'pages': (total + per_page - 1) // per_page,
+                'next_cursor': _make_stores_cursor(stores[-1]) if len(stores) == per_page else None
             }
         })
+        if 'page' in request.args:
+            response.headers['Deprecation'] = 'true'
+        return response
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -454,45 +734,42 @@ def api_stores():
 def api_store_detail(store_id):
     """Get detailed store information"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get store
-        cursor.execute("SELECT * FROM stores WHERE store_id = ?", (store_id,))
-        store_row = cursor.fetchone()
-        
-        if not store_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Store not found'}), 404
-        
-        store = dict(store_row)
-        
-        # Get coupons with usage stats
-        cursor.execute("""
-            SELECT 
-                c.*,
-                COUNT(r.id) as usage_report_count,
-                SUM(CASE WHEN r.worked = 1 THEN 1 ELSE 0 END) as worked_count,
-                SUM(CASE WHEN r.worked = 0 THEN 1 ELSE 0 END) as failed_count,
-                AVG(CASE WHEN r.worked = 1 THEN r.amount_saved END) as avg_savings
-            FROM coupons c
-            LEFT JOIN coupon_usage_reports r ON c.id = r.coupon_id
-            WHERE c.store_id = ?
-            GROUP BY c.id
-            ORDER BY c.created DESC
-        """, (store_id,))
-        coupons = [dict(row) for row in cursor.fetchall()]
-        
-        # Get partial URLs
-        cursor.execute("SELECT * FROM partial_urls WHERE store_id = ?", (store_id,))
-        partial_urls = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get store
+            cursor.execute("SELECT * FROM stores WHERE store_id = ?", (store_id,))
+            store_rows = fetch_dicts(cursor)
+            
+            if not store_rows:
+                return jsonify({'success': False, 'error': 'Store not found'}), 404
+            
+            store = store_rows[0]
+            
+            # Get coupons with usage stats
+            cursor.execute("""
+                SELECT 
+                    c.*,
+                    COUNT(r.id) as usage_report_count,
+                    SUM(CASE WHEN r.worked = 1 THEN 1 ELSE 0 END) as worked_count,
+                    SUM(CASE WHEN r.worked = 0 THEN 1 ELSE 0 END) as failed_count,
+                    AVG(CASE WHEN r.worked = 1 THEN r.amount_saved END) as avg_savings
+                FROM coupons c
+                LEFT JOIN coupon_usage_reports r ON c.id = r.coupon_id
+                WHERE c.store_id = ?
+                GROUP BY c.id
+                ORDER BY c.created DESC
+            """, (store_id,))
+            coupons = fetch_dicts(cursor)
+            
+            # Get partial URLs
+            cursor.execute("SELECT * FROM partial_urls WHERE store_id = ?", (store_id,))
+            partial_urls = fetch_dicts(cursor)
         
-        # Parse raw JSON if available
+        # Send raw JSON as text; the page parses it itself when it builds the detail view
         if store.get('raw_json'):
             try:
-                store['details'] = json.loads(store['raw_json'])
+                store['raw_json'] = raw_json_text(store['raw_json'])
             except:
                 pass
         
@@ -510,17 +787,16 @@ def api_store_detail(store_id):
 def api_coupon_usage(coupon_id):
     """Get usage reports for a coupon"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM coupon_usage_reports
-            WHERE coupon_id = ?
-            ORDER BY reported_at DESC
-        """, (coupon_id,))
-        
-        reports = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM coupon_usage_reports
+                WHERE coupon_id = ?
+                ORDER BY reported_at DESC
+            """, (coupon_id,))
+            
+            reports = fetch_dicts(cursor)
         
         return jsonify({'success': True, 'reports': reports})
     except Exception as e:
@@ -537,28 +813,27 @@ def api_report_coupon_usage():
         if not all(k in data for k in required):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO coupon_usage_reports (
-                coupon_id, store_id, code, worked, amount_saved, 
-                amount_spent, notes, reported_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            data['coupon_id'],
-            data['store_id'],
-            data['code'],
-            1 if data['worked'] else 0,
-            data.get('amount_saved'),
-            data.get('amount_spent'),
-            data.get('notes'),
-            int(time.time() * 1000)
-        ))
-        
-        conn.commit()
-        report_id = cursor.lastrowid
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT INTO coupon_usage_reports (
+                    coupon_id, store_id, code, worked, amount_saved, 
+                    amount_spent, notes, reported_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                data['coupon_id'],
+                data['store_id'],
+                data['code'],
+                1 if data['worked'] else 0,
+                data.get('amount_saved'),
+                data.get('amount_spent'),
+                data.get('notes'),
+                int(time.time() * 1000)
+            ))
+            
+            conn.commit()
+            report_id = cursor.lastrowid
         
         return jsonify({'success': True, 'report_id': report_id})
     except Exception as e:
@@ -566,50 +841,52 @@ def api_report_coupon_usage():
 
 
 @app.route('/api/countries')
+@ttl_cache(ttl=3.0)
 def api_countries():
     """Get list of countries"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DISTINCT country, COUNT(*) as count
-            FROM stores
-            WHERE country IS NOT NULL
-            GROUP BY country
-            ORDER BY count DESC
-        """)
-        countries = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT DISTINCT country, COUNT(*) as count
+                FROM stores
+                WHERE country IS NOT NULL
+                GROUP BY country
+                ORDER BY count DESC
+            """)
+            countries = fetch_dicts(cursor)
         
         return jsonify({'success': True, 'countries': countries})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _stream_export(export, extension: str, mimetype: str) -> Response:
+    """Stream an export generator from scraper to the client as a download"""
+    def generate():
+        # Hold a pooled connection for as long as the download runs
+        with get_db_connection() as conn:
+            yield from export(conn)
+    
+    filename = f"honey_stores_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(
+        generate(),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
 @app.route('/api/export/csv')
 def api_export_csv():
     """Export stores to CSV"""
-    try:
-        scraper = HoneyScraper(db_path=DB_PATH)
-        filename = f"honey_stores_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        scraper.export_to_csv(filename)
-        return send_file(filename, as_attachment=True)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    return _stream_export(iter_csv_export, 'csv', 'text/csv')
 
 
 @app.route('/api/export/json')
 def api_export_json():
     """Export stores to JSON"""
-    try:
-        scraper = HoneyScraper(db_path=DB_PATH)
-        filename = f"honey_stores_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        scraper.export_to_json(filename)
-        return send_file(filename, as_attachment=True)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    return _stream_export(iter_json_export, 'json', 'application/json')
 
 
 def main():
@@ -623,6 +900,21 @@ def main():
     
     args = parser.parse_args()
     
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    
+    # Create any missing tables/indices and refresh the planner's statistics.
+    # Both write, so a scraper holding the write lock just postpones them.
+    conn = _create_connection()
+    conn.isolation_level = None
+    try:
+        init_schema(conn)
+        conn.execute("ANALYZE")
+    except sqlite3.OperationalError as e:
+        print(f"Skipping schema check/ANALYZE on startup: {e}")
+    finally:
+        conn.close()
+    
     print("="*60)
     print("HONEY SCRAPER WEB DASHBOARD")
     print("="*60)